@@ -18,15 +18,31 @@
 
 # Author: Adhi Hargo (cadmus.sw@gmail.com)
 
+import argparse
+import collections
+import concurrent.futures
 import csv
+import gzip
+import hashlib
+import json
 import os
+import queue
 import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import xml.dom
 import zipfile
 
 import bpy
+from bpy.app.handlers import persistent
 from bpy.types import Operator, Panel
 from bpy_extras.io_utils import ImportHelper
+from mathutils import Matrix
 
 bl_info = {
     "name": "OHA Layout Tools",
@@ -79,6 +95,19 @@ MIMETYPE_FN = "mimetype"
 MIMETYPE_DATA = "application/vnd.oasis.opendocument.spreadsheet"
 STYLES_FN = "styles.xml"
 
+# Shot signatures of the last extraction, kept in the layout directory.
+EXTRACT_MANIFEST_FN = "extract_manifest.json"
+# Shots left to extract after hitting the memory ceiling.
+EXTRACT_CHECKPOINT_FN = "extract_checkpoint.json"
+
+# Custom properties of placeholder objects, pointing to the real one.
+PLACEHOLDER_LIBRARY_PROP = "oha_asset_library"
+PLACEHOLDER_NAME_PROP = "oha_asset_name"
+# Object.type values of the .blend format.
+BLEND_OBJECT_TYPES = {0: 'EMPTY', 1: 'MESH', 2: 'CURVE', 3: 'SURFACE', 4: 'FONT',
+                      5: 'META', 10: 'LAMP', 11: 'CAMERA', 12: 'SPEAKER',
+                      22: 'LATTICE', 25: 'ARMATURE'}
+
 
 class OHA_LayoutToolsProps(bpy.types.PropertyGroup):
     render_marker_infos = []
@@ -98,6 +127,11 @@ class OHA_LayoutToolsPreferences(bpy.types.AddonPreferences):
         description="Write shot list to Excel comma-separated values.",
         default=False)
 
+    is_export_stats = bpy.props.BoolProperty(
+        name="Shot Statistics",
+        description="After extraction, write render/save time and file sizes of each shot, in the chosen formats and JSON.",
+        default=False)
+
     layout_path = bpy.props.StringProperty(
         name="Base Layout Path",
         description="""Base path for all extracted sound and .blend files.
@@ -109,6 +143,16 @@ class OHA_LayoutToolsPreferences(bpy.types.AddonPreferences):
         description="Render video instead of audio file.",
         default=False)
 
+    is_deferred_compress = bpy.props.BoolProperty(
+        name="Compress in Background",
+        description="Save layout files uncompressed, then compress them in background processes.",
+        default=False)
+
+    memory_limit = bpy.props.IntProperty(
+        name="Memory Ceiling (MB)",
+        description="When Blender uses more memory than this during extraction, reload the file and resume with the remaining shots. 0 means no limit.",
+        default=0, min=0)
+
     def draw(self, context):
         layout = self.layout
 
@@ -118,12 +162,17 @@ class OHA_LayoutToolsPreferences(bpy.types.AddonPreferences):
         row = cols.row(align=True)
         row.prop(self, "is_export_ods", text="ODS", toggle=True)
         row.prop(self, "is_export_csv", text="CSV", toggle=True)
+        row.prop(self, "is_export_stats", text="Stats", toggle=True)
 
         cols.label("Layout Path:")
         cols.prop(self, "layout_path", text="")
 
         row = layout.row()
         row.prop(self, "is_render_video")
+        row.prop(self, "is_deferred_compress")
+
+        row = layout.row()
+        row.prop(self, "memory_limit")
 
 
 # ============================== operators =============================
@@ -138,6 +187,14 @@ class ExtractShotfiles_Base():
     render_selected = False
 
     _timer = None
+    progress = None  # ExtractProgress of the current run
+    shot_signatures = None  # shot name -> signature, see get_shot_signature()
+    last_progress = None  # ExtractProgress of the last finished run
+    last_checkpoint = None  # checkpoint path left by the last run, if any
+    deferred_names = None  # shots put off until the file is reloaded
+    cancelled_name = None  # shot whose render was cut short with ESC
+    resumed_stats = []  # statistics of shots done before a checkpoint
+    resumed_time = 0.0
 
     scene_frame_start = None
     scene_frame_end = None
@@ -164,158 +221,61 @@ class ExtractShotfiles_Base():
                and not props.render_marker_infos
 
     def write_shot_listing_csv(self, props, lpath):
-        try:
-            csvfile = open(lpath, "w", newline='')
-        except:
+        if not write_listing_csv(
+                lpath, ["Shot", "Start", "End", "Duration"],
+                [[mi['name'], mi['start'], mi['end'], mi['end'] - mi['start']]
+                 for mi in props.marker_infos]):
             self.report({"WARNING"}, 'Unable to open "%s", shotlist not written.' % lpath)
-            return
-
-        csvwriter = csv.writer(csvfile, dialect="excel-tab", quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(["Shot", "Start", "End", "Duration"])
-        for mi in props.marker_infos:
-            csvwriter.writerow([mi['name'], mi['start'], mi['end'], mi['end'] - mi['start']])
-
-        csvfile.close()
 
     def write_shot_listing_ods(self, props, lpath):
-        try:
-            doc = zipfile.ZipFile(lpath, "w", zipfile.ZIP_DEFLATED)
-        except:
+        if not write_listing_ods(
+                lpath, ["Shot", "Frame Start", "Frame End", "Duration"],
+                [[mi['name'], mi['start'], mi['end'], mi['end'] - mi['start']]
+                 for mi in props.marker_infos]):
             self.report({"WARNING"}, 'Unable to open "%s", shotlist not written.' % lpath)
-            return
-
-        doc.writestr(MIMETYPE_FN, MIMETYPE_DATA, zipfile.ZIP_STORED)
-        doc.writestr(MANIFEST_FN, MANIFEST_DATA)
-
-        content_doc = xml.dom.getDOMImplementation().createDocument(
-            "office", "office:document-content", None)
-        content_element = content_doc.documentElement
-        for key, value in CONTENT_DOCATTRS:
-            content_doc.documentElement.setAttribute(key, value)
-        for element in ("office:scripts", "office:automatic-styles",
-                        "office:font-face-decls"):
-            content_doc.documentElement.appendChild(content_doc.createElement(element))
-        body = content_doc.createElement("office:body")
-        spreadsheet = content_doc.createElement("office:spreadsheet")
-        table = content_doc.createElement("table:table")
-        column = content_doc.createElement("table:table-column")
-        content_element.appendChild(body)
-        body.appendChild(spreadsheet)
-        spreadsheet.appendChild(table)
-        table.appendChild(column)
-
-        # Insert header
-        if True:
-            row = content_doc.createElement("table:table-row")
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "string")
-            # cell.setAttribute("table:style-name", "Heading")
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode("Shot")
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "string")
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode("Frame Start")
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "string")
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode("Frame End")
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "string")
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode("Duration")
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            table.appendChild(row)
-
-        table.setAttribute("table:name", "Sheet1")
-        for mi in props.marker_infos:
-            framestart = str(mi['start'])
-            frameend = str(mi['end'])
-            framecount = str(mi['end'] - mi['start'])
-            row = content_doc.createElement("table:table-row")
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "string")
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode(mi["name"])
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
 
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "float")
-            cell.setAttribute("office:value", framestart)
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode(framestart)
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "float")
-            cell.setAttribute("office:value", frameend)
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode(frameend)
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
-
-            cell = content_doc.createElement("table:table-cell")
-            cell.setAttribute("office:value-type", "float")
-            cell.setAttribute("office:value", framecount)
-            text = content_doc.createElement("text:p")
-            text_data = content_doc.createTextNode(framecount)
-            text.appendChild(text_data)
-            cell.appendChild(text)
-            row.appendChild(cell)
+    def write_shot_stats(self, context):
+        # Written after extraction, with per-shot figures of this run.
+        prefs = context.user_preferences.addons[__name__].preferences
+        blenddir, blendfile = os.path.split(self.blendpath)
+        basepath = os.path.join(blenddir, os.path.splitext(blendfile)[0] + '_stats')
+        stats = self.resumed_stats + self.progress.shot_stats()
+
+        render_time = sum(st['render_time'] or 0.0 for st in stats)
+        rendered_frames = sum(st['frames'] for st in stats if st['render_time'])
+        run = {'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+               'file': self.blendpath,
+               'time': round(self.resumed_time + self.progress.elapsed(), 3),
+               'render_time': round(render_time, 3),
+               'save_time': round(sum(st['save_time'] or 0.0 for st in stats), 3),
+               'fps': round(rendered_frames / render_time, 3) if render_time else 0.0,
+               'shots': stats}
+
+        if prefs.is_deferred_compress:
+            # Layout sizes so far are from before compression. Rather
+            # than holding up the interface, the compressor writes the
+            # stats once it's done, with the sizes files end up with.
+            layoutdir = os.path.join(self.render_basepath, 'layouts')
+            blendpaths = dict(
+                (st['shot'], bpy.path.ensure_ext(
+                    filepath=os.path.join(layoutdir, st['shot']), ext=".blend"))
+                for st in stats)
+            is_export_ods, is_export_csv = prefs.is_export_ods, prefs.is_export_csv
+
+            def write_compressed(sizes):
+                for st in stats:
+                    if st['blend_bytes'] is not None and blendpaths[st['shot']] in sizes:
+                        st['blend_bytes'] = sizes[blendpaths[st['shot']]]
+                for path in write_stats_files(basepath, run, is_export_ods, is_export_csv):
+                    sys.stdout.write('Unable to write "%s".\n' % path)
+                sys.stdout.flush()
+
+            deferred_compressor.when_done(write_compressed)
+            return
 
-            table.appendChild(row)
-
-        doc.writestr(CONTENT_FN, content_doc.toxml(encoding="UTF-8"))
-
-        meta_doc = xml.dom.getDOMImplementation().createDocument(
-            "office", "office:document-meta", None)
-        for key, value in META_DOCATTRS:
-            meta_doc.documentElement.setAttribute(key, value)
-        meta = meta_doc.createElement("office:meta")
-        meta_doc.documentElement.appendChild(meta)
-        doc.writestr(META_FN, meta_doc.toxml(encoding="UTF-8"))
-
-        settings_doc = xml.dom.getDOMImplementation().createDocument(
-            "office", "office:document-settings", None)
-        for key, value in SETTINGS_DOCATTRS:
-            settings_doc.documentElement.setAttribute(key, value)
-        settings = settings_doc.createElement("office:settings")
-        settings_doc.documentElement.appendChild(settings)
-        doc.writestr(SETTINGS_FN, settings_doc.toxml(encoding="UTF-8"))
-
-        styles_doc = xml.dom.getDOMImplementation().createDocument(
-            "office", "office:document-styles", None)
-        for key, value in CONTENT_DOCATTRS:
-            styles_doc.documentElement.setAttribute(key, value)
-        styles = styles_doc.createElement("office:styles")
-        styles_doc.documentElement.appendChild(styles)
-        masterstyles = styles_doc.createElement("office:master-styles")
-        styles_doc.documentElement.appendChild(masterstyles)
-        autostyles = styles_doc.createElement("office:automatic-styles")
-        styles_doc.documentElement.appendChild(autostyles)
-        doc.writestr(STYLES_FN, styles_doc.toxml(encoding="UTF-8"))
+        for path in write_stats_files(basepath, run, prefs.is_export_ods,
+                                      prefs.is_export_csv):
+            self.report({"WARNING"}, 'Unable to write "%s".' % path)
 
     def write_shot_files(self, context):
         scene = context.scene
@@ -327,9 +287,14 @@ class ExtractShotfiles_Base():
         self.restore_scene_settings(context)
         bpy.ops.sequencer.select_all(action='SELECT')
         bpy.ops.sequencer.delete()
+        manifest = read_extract_manifest(self.render_basepath)
         for mi in props.marker_infos:
             if (self.render_selected and not mi['select']):
                 continue
+            if mi['name'] in self.deferred_names:
+                continue
+            if mi['name'] == self.cancelled_name:
+                continue  # its media file is cut short
 
             seq = None
             seq2 = None
@@ -358,8 +323,21 @@ class ExtractShotfiles_Base():
             layoutdir = os.path.join(self.render_basepath, 'layouts')
             markerpath = bpy.path.ensure_ext(
                 filepath=os.path.join(layoutdir, mi['name']), ext=".blend")
-            bpy.ops.wm.save_as_mainfile(filepath=markerpath, copy=True,
-                                        relative_remap=True)
+            self.progress.save_begin(mi)
+            if prefs.is_deferred_compress:
+                deferred_compressor.wait(markerpath)
+                bpy.ops.wm.save_as_mainfile(filepath=markerpath, copy=True,
+                                            relative_remap=True, compress=False)
+                deferred_compressor.submit(markerpath)
+            else:
+                bpy.ops.wm.save_as_mainfile(filepath=markerpath, copy=True,
+                                            relative_remap=True)
+            self.progress.save_end()
+            self.progress.record_files(mi['name'], path, markerpath)
+            # Only shots rendered to the end in this run are known to
+            # match their signature, older media files may be stale.
+            if self.progress.shots.get(mi['name'], {}).get('render_time') is not None:
+                manifest[mi['name']] = self.shot_signatures[mi['name']]
 
             # Remove strips, prepare for next file
             if seq:
@@ -367,24 +345,16 @@ class ExtractShotfiles_Base():
             if seq2:
                 sequences.remove(seq2)
 
+        write_extract_manifest(self.render_basepath, manifest)
+
     def init_marker_infos(self, context):
         # Store marker informations so the markers themselves can be
         # deleted.
         scene = context.scene
         props = scene.oha_layout_tools
 
-        markers = [marker for marker in scene.timeline_markers
-                   if marker.frame >= scene.frame_start
-                   and marker.frame < scene.frame_end]
-        markers.sort(key=lambda m: m.frame)
-
         props.marker_infos.clear()
-        for m, frame_end in zip(
-                markers, [m.frame for m in markers[1:]] + [scene.frame_end]):
-            props.marker_infos.append({'name': m.name,
-                                       'select': m.select,
-                                       'start': m.frame,
-                                       'end': frame_end})
+        props.marker_infos.extend(get_marker_infos(scene))
 
         props.render_marker_infos.clear()
         props.render_marker_infos.extend(
@@ -397,21 +367,90 @@ class ExtractShotfiles_Base():
         if props.render_marker_infos:
             rmi = props.render_marker_infos.pop(0)
             rmi_idx = props.marker_infos.index(rmi) + 1
-            context.area.header_text_set(
-                'Rendering shot "%s" (%d of %d, %d frames)' %
-                (rmi['name'], rmi_idx, len(props.marker_infos),
-                 rmi['end'] - rmi['start']))
-            context.area.tag_redraw()
+            self.progress.render_begin(rmi)
+            if context.area:
+                context.area.header_text_set(
+                    'Rendering shot "%s" (%d of %d, %d frames) %s' %
+                    (rmi['name'], rmi_idx, len(props.marker_infos),
+                     rmi['end'] - rmi['start'], self.progress.status_text()))
+                context.area.tag_redraw()
             self.marker_scene_settings(context, rmi)
 
     def render_complete_handler(self, context):
         props = context.scene.oha_layout_tools
+        prefs = context.user_preferences.addons[__name__].preferences
 
         if not props.render_marker_infos:
             self.write_shot_files(context)
+            deferred_compressor.finish()
+            self.progress.end()
+            self.write_checkpoint(context)
+            if prefs.is_export_stats and not self.deferred_names:
+                self.write_shot_stats(context)
+            ExtractShotfiles_Base.last_progress = self.progress
             props.marker_infos.clear()
-            context.area.header_text_set()
-            bpy.ops.wm.open_mainfile(filepath=self.blendpath)
+            if context.area:
+                context.area.header_text_set()
+            # Reloading is also what frees the memory for the next round.
+            if self.reload_file or self.deferred_names:
+                bpy.ops.wm.open_mainfile(filepath=self.blendpath)
+
+    def defer_remaining_shots(self, context):
+        # Memory ceiling reached: stop rendering and leave the remaining
+        # shots for after the file has been reloaded.
+        props = context.scene.oha_layout_tools
+
+        self.deferred_names.update(mi['name'] for mi in props.render_marker_infos)
+        props.render_marker_infos.clear()
+        self.report({"INFO"}, "Memory ceiling reached, %d shots left for later." %
+                    len(self.deferred_names))
+
+    def write_checkpoint(self, context):
+        props = context.scene.oha_layout_tools
+        checkpoint_path = os.path.join(self.render_basepath, EXTRACT_CHECKPOINT_FN)
+
+        if not self.deferred_names:
+            ExtractShotfiles_Base.last_checkpoint = None
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            return
+
+        checkpoint = {
+            'file': self.blendpath,
+            'remaining': [mi['name'] for mi in props.marker_infos
+                          if mi['name'] in self.deferred_names],
+            'stats': self.resumed_stats +
+                     [st for st in self.progress.shot_stats()
+                      if st['render_time'] is not None],
+            'time': self.resumed_time + self.progress.elapsed()}
+        with open(checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f, indent=1)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+        ExtractShotfiles_Base.last_checkpoint = checkpoint_path
+
+    def load_checkpoint(self, context):
+        # Select the markers of shots left by the previous round, so that
+        # only those are extracted.
+        scene = context.scene
+        prefs = context.user_preferences.addons[__name__].preferences
+        ExtractShotfiles_Base.last_checkpoint = None
+
+        blendpath = bpy.path.abspath(context.blend_data.filepath)
+        checkpoint_path = os.path.join(
+            get_layout_basepath(blendpath, prefs.layout_path), EXTRACT_CHECKPOINT_FN)
+        try:
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            self.report({"ERROR"}, "No extraction to resume.")
+            return {"CANCELLED"}
+
+        remaining = set(checkpoint['remaining'])
+        for marker in scene.timeline_markers:
+            marker.select = marker.name in remaining
+        self.render_selected = True
+        self.resumed_stats = checkpoint['stats']
+        self.resumed_time = checkpoint['time']
 
     def save_scene_settings(self, context):
         scene = context.scene
@@ -476,29 +515,33 @@ class ExtractShotfiles_Base():
         ffmpeg.audio_codec = 'MP3'
         ffmpeg.audio_bitrate = 192
 
-    def invoke(self, context, event):
+    def init_extraction(self, context):
+        # Prepare marker informations, layout directories and shot list.
+        # Returns None if extraction can proceed.
         scene = context.scene
         props = scene.oha_layout_tools
         prefs = context.user_preferences.addons[__name__].preferences
 
-        self.render_selected = (event.shift == True)
-
         if not context.blend_data.is_saved:
             self.report({"ERROR"}, "Could not extract from unsaved file.")
             return {"CANCELLED"}
         self.blendpath = bpy.path.abspath(context.blend_data.filepath)
 
+        self.deferred_names = set()
+        self.cancelled_name = None
         self.init_marker_infos(context)
         if not props.marker_infos:
-            return self.cancel(context)
+            self.report({"WARNING"}, "No shot markers to extract.")
+            return {"CANCELLED"}
         adjust_duration_to_effects(context)
+        self.shot_signatures = dict(
+            (mi['name'], get_shot_signature(scene, mi, prefs.is_render_video))
+            for mi in props.marker_infos)
 
         blenddir, blendfile = os.path.split(self.blendpath)
         blendname = os.path.splitext(blendfile)[0]
-        template_str = re.sub(r"(%\([^)]+\))", r"\1s", prefs.layout_path.strip())
-        template_dict = dict(blendname=blendname)
-        self.render_basepath = os.path.abspath(
-            os.path.join(blenddir, template_str % template_dict))
+        self.render_basepath = get_layout_basepath(self.blendpath,
+                                                   prefs.layout_path)
 
         if not os.path.exists(self.render_basepath):
             try:
@@ -521,6 +564,21 @@ class ExtractShotfiles_Base():
                 props, os.path.join(blenddir, blendname + '.txt'))
         self.save_scene_settings(context)
 
+        self.progress = ExtractProgress(
+            props.render_marker_infos,
+            window_manager=None if bpy.app.background else context.window_manager,
+            stream=sys.stdout if bpy.app.background else None)
+
+    def invoke(self, context, event):
+        self.render_selected = (event.shift == True) or self.selected_only
+
+        result = self.load_checkpoint(context) if self.resume else None
+        if result:
+            return result
+        result = self.init_extraction(context)
+        if result:
+            return result
+
         return self.execute(context)
 
 
@@ -530,6 +588,22 @@ class SEQUENCER_OT_ExtractShotfiles(ExtractShotfiles_Base, Operator):
     bl_label = 'Create Layout'
     bl_options = {'REGISTER'}
 
+    selected_only = bpy.props.BoolProperty(
+        name="Selected Only",
+        description="Only extract shots of selected markers",
+        default=False,
+        options={'SKIP_SAVE'})
+    reload_file = bpy.props.BoolProperty(
+        name="Reload File",
+        description="Reopen the animatic file once extraction is done",
+        default=True,
+        options={'SKIP_SAVE'})
+    resume = bpy.props.BoolProperty(
+        name="Resume",
+        description="Extract the shots left by the memory ceiling",
+        default=False,
+        options={'SKIP_SAVE'})
+
     prev_stat = None
 
     def check_render_file(self, context):
@@ -552,6 +626,11 @@ class SEQUENCER_OT_ExtractShotfiles(ExtractShotfiles_Base, Operator):
             self.prev_stat = cur_stat
             return {'PASS_THROUGH'}
 
+        # The timer notices the finished file up to two ticks late, its
+        # last write is when rendering actually ended.
+        self.progress.render_end(end_time=cur_stat.st_mtime)
+        if props.render_marker_infos and memory_exceeded(prefs.memory_limit):
+            self.defer_remaining_shots(context)
         self.render_complete_handler(context)
 
         if props.render_marker_infos:
@@ -575,6 +654,7 @@ class SEQUENCER_OT_ExtractShotfiles(ExtractShotfiles_Base, Operator):
             return self.check_render_file(context)
         elif event.type == 'ESC':
             props.render_marker_infos.clear()
+            self.cancelled_name = self.progress.render_cancel()
             self.render_complete_handler(context)
 
             return {'FINISHED'}
@@ -587,22 +667,95 @@ class SEQUENCER_OT_ExtractShotfiles(ExtractShotfiles_Base, Operator):
         props = scene.oha_layout_tools
         prefs = context.user_preferences.addons[__name__].preferences
 
+        if bpy.app.background:
+            return self.execute_background(context)
+
         if not self.blendpath:
             self.report({"ERROR"}, "Could not extract from unsaved file.")
             return {"CANCELLED"}
 
+        if not props.render_marker_infos:
+            self.progress.end()
+            return {'FINISHED'}
+
         wm.modal_handler_add(self)
         self._timer = wm.event_timer_add(2.0, context.window)
 
-        if props.render_marker_infos:
+        self.render_pre_handler(context)
+        if prefs.is_render_video:
+            bpy.ops.render.render('INVOKE_DEFAULT', animation=True)
+        else:
+            bpy.ops.sound.mixdown('INVOKE_DEFAULT', filepath=self.render_filepath_aud,
+                                  container='WAV', codec="PCM")
+
+        return {'RUNNING_MODAL'}
+
+    def execute_background(self, context):
+        # Without a window there are no timer events to poll the render
+        # file with, so render each shot synchronously instead.
+        props = context.scene.oha_layout_tools
+        prefs = context.user_preferences.addons[__name__].preferences
+
+        if not self.blendpath:
+            self.render_selected = self.selected_only
+            result = self.load_checkpoint(context) if self.resume else None
+            if result:
+                return result
+            result = self.init_extraction(context)
+            if result:
+                return result
+
+        while props.render_marker_infos:
             self.render_pre_handler(context)
             if prefs.is_render_video:
-                bpy.ops.render.render('INVOKE_DEFAULT', animation=True)
+                bpy.ops.render.render(animation=True)
             else:
-                bpy.ops.sound.mixdown('INVOKE_DEFAULT', filepath=self.render_filepath_aud,
+                bpy.ops.sound.mixdown(filepath=self.render_filepath_aud,
                                       container='WAV', codec="PCM")
+            self.progress.render_end()
+            if props.render_marker_infos and memory_exceeded(prefs.memory_limit):
+                self.defer_remaining_shots(context)
+        self.render_complete_handler(context)
+
+        return {'FINISHED'}
+
+
+class SEQUENCER_OT_VerifyShotfiles(Operator):
+    '''Check extracted sound/video and layout files against the shot list'''
+    bl_idname = 'sequencer.oha_verify_shot_files'
+    bl_label = 'Verify Layout'
+    bl_options = {'REGISTER'}
 
-            return {'RUNNING_MODAL'}
+    @classmethod
+    def poll(cls, context):
+        return context.blend_data.is_saved
+
+    def execute(self, context):
+        scene = context.scene
+        prefs = context.user_preferences.addons[__name__].preferences
+
+        marker_infos = get_marker_infos(scene)
+        if not marker_infos:
+            self.report({"WARNING"}, "No shot markers to verify.")
+            return {"CANCELLED"}
+        adjust_duration_to_effects(context, marker_infos)
+
+        blendpath = bpy.path.abspath(context.blend_data.filepath)
+        render_basepath = get_layout_basepath(blendpath, prefs.layout_path)
+
+        time_start = time.time()
+        problems = verify_shot_files(
+            marker_infos, render_basepath,
+            scene.render.fps / scene.render.fps_base, scene.frame_start,
+            scene_name=scene.name, is_render_video=prefs.is_render_video)
+
+        for name, problem, message in problems:
+            self.report({"WARNING"}, '%s "%s": %s.' % (problem, name, message))
+        bad_shots = len(set(name for name, problem, message in problems))
+        self.report({"WARNING"} if problems else {"INFO"},
+                    '%d of %d shots OK, checked in %.1fs.' %
+                    (len(marker_infos) - bad_shots, len(marker_infos),
+                     time.time() - time_start))
 
         return {'FINISHED'}
 
@@ -632,12 +785,21 @@ class SCENE_OT_ImportAssets(Operator, ImportHelper):
         name="Camera",
         default=True,
     )
+    is_placeholder = bpy.props.BoolProperty(
+        name="Placeholders",
+        description="Import bounding box stand-ins instead of the objects themselves, "
+                    "to be materialised later. Settings are not copied",
+        default=False,
+    )
 
     def draw(self, context):
         layout = self.layout
 
+        layout.prop(self, "is_placeholder")
+
         layout.label("Extra Settings to Copy:")
         col = layout.column_flow(columns=2, align=True)
+        col.active = not self.is_placeholder
         col.prop(self, "is_import_scs", toggle=True)
         col.prop(self, "is_import_res", toggle=True)
 
@@ -744,7 +906,58 @@ class SCENE_OT_ImportAssets(Operator, ImportHelper):
             old_scene.name = scene_name
         bpy.data.scenes.remove(new_scene)
 
+    def import_placeholders(self, context):
+        # Only the object headers are read from the file; cameras are
+        # light enough to be appended as they are.
+        cur_scene = context.scene
+        try:
+            object_infos = get_blend_objects(self.filepath)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            self.report({"ERROR"}, 'Unable to read "%s": %s' % (self.filepath, e))
+            return {'CANCELLED'}
+
+        cameras = [oi['name'] for oi in object_infos if oi['type'] == 'CAMERA']
+        if cameras and self.is_import_cam:
+            with bpy.data.libraries.load(self.filepath) as (data_from, data_to):
+                data_to.objects = [name for name in data_from.objects
+                                   if name in cameras]
+            for obj in data_to.objects:
+                if obj:
+                    obj.select = False
+                    cur_scene.objects.link(obj)
+
+        for oi in object_infos:
+            if oi['type'] == 'CAMERA':
+                continue
+
+            if oi['bounds']:
+                (x0, y0, z0), (x1, y1, z1) = oi['bounds']
+                mesh = bpy.data.meshes.new(oi['name'] + ".placeholder")
+                mesh.from_pydata(
+                    [(x, y, z) for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)],
+                    [(0, 1), (2, 3), (4, 5), (6, 7), (0, 2), (1, 3),
+                     (4, 6), (5, 7), (0, 4), (1, 5), (2, 6), (3, 7)], [])
+                mesh.update()
+                obj = bpy.data.objects.new(oi['name'], mesh)
+                obj.draw_type = 'WIRE'
+            else:
+                obj = bpy.data.objects.new(oi['name'], None)
+                obj.empty_draw_type = 'CUBE'
+
+            obj.matrix_world = Matrix(oi['matrix']).transposed()
+            if oi['layers'] & 0xfffff:
+                obj.layers = [bool(oi['layers'] & (1 << i)) for i in range(20)]
+            obj[PLACEHOLDER_LIBRARY_PROP] = self.filepath
+            obj[PLACEHOLDER_NAME_PROP] = oi['name']
+            cur_scene.objects.link(obj)
+        cur_scene.update()
+
+        return {'FINISHED'}
+
     def execute(self, context):
+        if self.is_placeholder:
+            return self.import_placeholders(context)
+
         scene_list = []
         with bpy.data.libraries.load(self.filepath) as (data_from, data_to):
             scene_list.extend(data_from.scenes)
@@ -803,19 +1016,301 @@ class OBJECT_OT_proxy_make_all(Operator):
         return {'FINISHED'}
 
 
+# Replace placeholders from Import Assets with the actual objects
+class VIEW3D_PT_placeholders(Panel):
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_category = "Relations"
+    bl_context = "objectmode"
+    bl_label = "OHA Placeholders"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.operator("object.oha_materialise", icon="APPEND_BLEND")
+
+
+class OBJECT_OT_materialise(Operator):
+    """Load the actual objects of all selected placeholders"""
+    bl_idname = "object.oha_materialise"
+    bl_label = "Materialise"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return any(PLACEHOLDER_LIBRARY_PROP in obj for obj in context.selected_objects)
+
+    def execute(self, context):
+        scene = context.scene
+
+        placeholders = collections.OrderedDict()
+        for obj in context.selected_objects:
+            if PLACEHOLDER_LIBRARY_PROP in obj:
+                placeholders.setdefault(
+                    bpy.path.abspath(obj[PLACEHOLDER_LIBRARY_PROP]), []).append(obj)
+
+        count = 0
+        for filepath, objs in placeholders.items():
+            if not os.path.exists(filepath):
+                self.report({"WARNING"}, 'Asset file "%s" not found.' % filepath)
+                continue
+
+            # Free the names, so loaded objects keep their own.
+            for obj in objs:
+                obj.name = obj[PLACEHOLDER_NAME_PROP] + ".placeholder"
+            requested = []
+            with bpy.data.libraries.load(filepath) as (data_from, data_to):
+                requested.extend(collections.OrderedDict.fromkeys(
+                    obj[PLACEHOLDER_NAME_PROP] for obj in objs
+                    if obj[PLACEHOLDER_NAME_PROP] in data_from.objects))
+                data_to.objects = list(requested)
+            # Appended objects may be renamed on a name clash, but they
+            # come back in the order they were asked for.
+            loaded = dict(zip(requested, data_to.objects))
+
+            placed = set()
+            for placeholder in objs:
+                name = placeholder[PLACEHOLDER_NAME_PROP]
+                obj = loaded.get(name)
+                if obj is None:
+                    placeholder.name = name
+                    self.report({"WARNING"}, 'Object "%s" not found in "%s".' %
+                                (name, filepath))
+                    continue
+                # More placeholders of the same object (imported twice,
+                # say) get linked duplicates of the one loaded.
+                if name in placed:
+                    obj = obj.copy()
+                placed.add(name)
+
+                # Keep any blocking done on the placeholder.
+                scene.objects.link(obj)
+                obj.matrix_world = placeholder.matrix_world
+                obj.layers = placeholder.layers
+                obj.select = True
+
+                mesh = placeholder.data
+                for sc in placeholder.users_scene:
+                    sc.objects.unlink(placeholder)
+                bpy.data.objects.remove(placeholder)
+                if mesh and not mesh.users:
+                    bpy.data.meshes.remove(mesh)
+                count += 1
+
+        scene.update()
+        self.report({"INFO"}, "%d placeholders materialised." % count)
+        return {'FINISHED'}
+
+
 # ========================= auxiliary functions ========================
 
-def adjust_duration_to_effects(context):
+def get_marker_infos(scene):
+    markers = [marker for marker in scene.timeline_markers
+               if marker.frame >= scene.frame_start
+               and marker.frame < scene.frame_end]
+    markers.sort(key=lambda m: m.frame)
+
+    return [{'name': m.name,
+             'select': m.select,
+             'start': m.frame,
+             'end': frame_end}
+            for m, frame_end in zip(
+                markers, [m.frame for m in markers[1:]] + [scene.frame_end])]
+
+
+def get_layout_basepath(blendpath, layout_path):
+    # Expand the "%(name)" fields of the Layout Path preference into
+    # an absolute directory, relative to the .blend file.
+    blenddir, blendfile = os.path.split(blendpath)
+    blendname = os.path.splitext(blendfile)[0]
+    template_str = re.sub(r"(%\([^)]+\))", r"\1s", layout_path.strip())
+    template_dict = dict(blendname=blendname)
+    return os.path.abspath(os.path.join(blenddir, template_str % template_dict))
+
+
+def get_shot_signature(scene, mi, is_render_video=False):
+    # Digest of everything that goes into a shot's rendered file: its
+    # length and the strips overlapping it, relative to the shot start
+    # so that moving a whole shot in time doesn't count as a change.
+    strips = []
+    for seq in scene.sequence_editor.sequences_all:
+        if seq.frame_final_end <= mi['start'] or seq.frame_final_start > mi['end']:
+            continue
+        sound = getattr(seq, 'sound', None)
+        elements = getattr(seq, 'elements', None) or []
+        strips.append([seq.name, seq.type, seq.channel, seq.mute,
+                       seq.frame_start - mi['start'],
+                       seq.frame_final_start - mi['start'],
+                       seq.frame_final_end - mi['start'],
+                       round(getattr(seq, 'volume', 1.0), 4),
+                       getattr(seq, 'filepath', '') or (sound.filepath if sound else ''),
+                       getattr(seq, 'directory', ''), len(elements),
+                       elements[0].filename if elements else ''])
+    strips.sort()
+
+    data = json.dumps([mi['end'] - mi['start'], is_render_video, strips])
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def read_extract_manifest(render_basepath):
+    # Signatures of the shots last extracted into a layout directory.
+    try:
+        with open(os.path.join(render_basepath, EXTRACT_MANIFEST_FN)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_extract_manifest(render_basepath, manifest):
+    filepath = os.path.join(render_basepath, EXTRACT_MANIFEST_FN)
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def write_listing_csv(lpath, header, rows):
+    # Tab-separated listing, returns False if the file can't be written.
+    try:
+        csvfile = open(lpath, "w", newline='')
+    except:
+        return False
+
+    csvwriter = csv.writer(csvfile, dialect="excel-tab", quoting=csv.QUOTE_MINIMAL)
+    csvwriter.writerow(header)
+    for row in rows:
+        csvwriter.writerow(row)
+
+    csvfile.close()
+    return True
+
+
+def write_listing_ods(lpath, header, rows):
+    # Numbers in rows are written as float cells, anything else as
+    # string cells. Returns False if the file can't be written.
+    try:
+        doc = zipfile.ZipFile(lpath, "w", zipfile.ZIP_DEFLATED)
+    except:
+        return False
+
+    doc.writestr(MIMETYPE_FN, MIMETYPE_DATA, zipfile.ZIP_STORED)
+    doc.writestr(MANIFEST_FN, MANIFEST_DATA)
+
+    content_doc = xml.dom.getDOMImplementation().createDocument(
+        "office", "office:document-content", None)
+    content_element = content_doc.documentElement
+    for key, value in CONTENT_DOCATTRS:
+        content_doc.documentElement.setAttribute(key, value)
+    for element in ("office:scripts", "office:automatic-styles",
+                    "office:font-face-decls"):
+        content_doc.documentElement.appendChild(content_doc.createElement(element))
+    body = content_doc.createElement("office:body")
+    spreadsheet = content_doc.createElement("office:spreadsheet")
+    table = content_doc.createElement("table:table")
+    column = content_doc.createElement("table:table-column")
+    content_element.appendChild(body)
+    body.appendChild(spreadsheet)
+    spreadsheet.appendChild(table)
+    table.appendChild(column)
+
+    table.setAttribute("table:name", "Sheet1")
+    for values in [header] + list(rows):
+        row = content_doc.createElement("table:table-row")
+
+        for value in values:
+            cell = content_doc.createElement("table:table-cell")
+            if isinstance(value, (int, float)):
+                value = str(value)
+                cell.setAttribute("office:value-type", "float")
+                cell.setAttribute("office:value", value)
+            else:
+                cell.setAttribute("office:value-type", "string")
+            text = content_doc.createElement("text:p")
+            text_data = content_doc.createTextNode(value)
+            text.appendChild(text_data)
+            cell.appendChild(text)
+            row.appendChild(cell)
+
+        table.appendChild(row)
+
+    doc.writestr(CONTENT_FN, content_doc.toxml(encoding="UTF-8"))
+
+    meta_doc = xml.dom.getDOMImplementation().createDocument(
+        "office", "office:document-meta", None)
+    for key, value in META_DOCATTRS:
+        meta_doc.documentElement.setAttribute(key, value)
+    meta = meta_doc.createElement("office:meta")
+    meta_doc.documentElement.appendChild(meta)
+    doc.writestr(META_FN, meta_doc.toxml(encoding="UTF-8"))
+
+    settings_doc = xml.dom.getDOMImplementation().createDocument(
+        "office", "office:document-settings", None)
+    for key, value in SETTINGS_DOCATTRS:
+        settings_doc.documentElement.setAttribute(key, value)
+    settings = settings_doc.createElement("office:settings")
+    settings_doc.documentElement.appendChild(settings)
+    doc.writestr(SETTINGS_FN, settings_doc.toxml(encoding="UTF-8"))
+
+    styles_doc = xml.dom.getDOMImplementation().createDocument(
+        "office", "office:document-styles", None)
+    for key, value in CONTENT_DOCATTRS:
+        styles_doc.documentElement.setAttribute(key, value)
+    styles = styles_doc.createElement("office:styles")
+    styles_doc.documentElement.appendChild(styles)
+    masterstyles = styles_doc.createElement("office:master-styles")
+    styles_doc.documentElement.appendChild(masterstyles)
+    autostyles = styles_doc.createElement("office:automatic-styles")
+    styles_doc.documentElement.appendChild(autostyles)
+    doc.writestr(STYLES_FN, styles_doc.toxml(encoding="UTF-8"))
+    doc.close()
+    return True
+
+def write_stats_files(basepath, run, is_export_ods=True, is_export_csv=True):
+    # Per-shot figures of an extraction run, as listings at `basepath`
+    # .ods/.txt and appended to `basepath`.json, which keeps every run
+    # for comparison between them. Returns the paths left unwritten.
+    # Renders take in the end marker's frame too, one more than the
+    # shot list's Duration, hence "Rendered".
+    header = ["Shot", "Rendered Frames", "Render Time", "Save Time",
+              "Frames per Second", "Media Size", "Layout Size"]
+    rows = [[st['shot'], st['frames']] +
+            ["" if st[key] is None else st[key]
+             for key in ('render_time', 'save_time', 'fps',
+                         'media_bytes', 'blend_bytes')]
+            for st in run['shots']]
+    failed = []
+    if is_export_ods and not write_listing_ods(basepath + '.ods', header, rows):
+        failed.append(basepath + '.ods')
+    if is_export_csv and not write_listing_csv(basepath + '.txt', header, rows):
+        failed.append(basepath + '.txt')
+
+    jsonpath = basepath + '.json'
+    try:
+        with open(jsonpath) as f:
+            runs = json.load(f)['runs']
+    except (OSError, ValueError, KeyError, TypeError):
+        runs = []
+    runs.append(run)
+    try:
+        with open(jsonpath + ".tmp", "w") as f:
+            json.dump({'runs': runs}, f, indent=1)
+        os.replace(jsonpath + ".tmp", jsonpath)
+    except OSError:
+        failed.append(jsonpath)
+    return failed
+
+
+def adjust_duration_to_effects(context, marker_infos=None):
     scene = context.scene
     props = scene.oha_layout_tools
     sequences = scene.sequence_editor.sequences
+    if marker_infos is None:
+        marker_infos = props.marker_infos
 
     effects = [seq for seq in sequences
                if isinstance(seq, bpy.types.EffectSequence)
                and seq.type in ['CROSS', 'ADD', 'SUBTRACT', 'ALPHA_OVER',
                                 'ALPHA_UNDER', 'GAMMA_CROSS', 'MULTIPLY',
                                 'OVER_DROP', 'WIPE']]
-    for mi in props.marker_infos:
+    for mi in marker_infos:
         overlap_start = [e for e in effects
                          if mi['start'] == e.frame_final_end]
         overlap_end = [e for e in effects
@@ -826,6 +1321,1007 @@ def adjust_duration_to_effects(context):
             mi['end'] = overlap_end[0].frame_final_end
 
 
+def get_memory_usage():
+    # Current resident memory of this process in bytes, None if unknown.
+    # The peak size (ru_maxrss) is no substitute: it never goes down, so
+    # the ceiling would stay crossed after a reload.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(),
+                ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+
+    return None
+
+
+memory_usage_warned = False
+
+
+def memory_exceeded(limit):
+    # Whether process memory is over `limit` megabytes, 0 being no limit.
+    # Without a way to read it the ceiling is ignored, with one warning.
+    global memory_usage_warned
+    if not limit:
+        return False
+    usage = get_memory_usage()
+    if usage is None:
+        if not memory_usage_warned:
+            memory_usage_warned = True
+            sys.stdout.write("Memory ceiling ignored, current memory use "
+                             "can't be read on this system.\n")
+            sys.stdout.flush()
+        return False
+    return usage > limit * 1048576
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ExtractProgress():
+    # Timing of an extraction run: frames per second of every rendered
+    # shot, time spent rendering versus saving, and an ETA from moving
+    # averages of seconds per frame and per saved file. Feeds the window
+    # manager's progress indicator and/or prints to a stream, so the
+    # same figures are available with and without a user interface.
+    SMOOTHING = 0.3  # weight of the latest shot in the moving averages
+
+    def __init__(self, marker_infos, window_manager=None, stream=None):
+        self.window_manager = window_manager
+        self.stream = stream
+
+        self.shots = collections.OrderedDict(
+            (mi['name'], {'frames': mi['end'] - mi['start'] + 1,
+                          'render_time': None, 'save_time': None,
+                          'media_bytes': None, 'blend_bytes': None})
+            for mi in marker_infos)
+        self.total_frames = sum(shot['frames'] for shot in self.shots.values())
+        self.rendered_frames = 0
+        self.saved_count = 0
+        self.render_time = 0.0
+        self.save_time = 0.0
+        self.frame_time_avg = None  # moving average, seconds per frame
+        self.save_time_avg = None  # moving average, seconds per file
+
+        self.current = None
+        self.phase_start = None
+        self.time_start = time.time()
+        self.percent_done = 0.0
+
+        if self.window_manager:
+            self.window_manager.progress_begin(0, 100)
+
+    def render_begin(self, mi):
+        self.current = mi['name']
+        self.phase_start = time.time()
+
+    def render_end(self, end_time=None):
+        if self.current is None:
+            return
+        shot = self.shots[self.current]
+        if end_time is None or end_time <= self.phase_start:  # coarse mtimes
+            end_time = time.time()
+        shot['render_time'] = elapsed = end_time - self.phase_start
+        self.render_time += elapsed
+        self.rendered_frames += shot['frames']
+        self.frame_time_avg = self.moving_average(
+            self.frame_time_avg, elapsed / shot['frames'])
+
+        self.emit('Shot "%s" rendered: %d frames in %.1fs (%.1f fps)' %
+                  (self.current, shot['frames'], elapsed,
+                   self.shot_fps(self.current)))
+        self.current = None
+
+    def render_cancel(self):
+        # The shot being rendered is left out of the figures, its render
+        # time and frames would only be made up. Returns its name.
+        name, self.current = self.current, None
+        if name is not None:
+            self.emit('Shot "%s" cancelled' % name)
+        return name
+
+    def save_begin(self, mi):
+        self.current = mi['name']
+        self.phase_start = time.time()
+
+    def save_end(self):
+        if self.current is None:
+            return
+        shot = self.shots[self.current]
+        shot['save_time'] = elapsed = time.time() - self.phase_start
+        self.save_time += elapsed
+        self.saved_count += 1
+        self.save_time_avg = self.moving_average(self.save_time_avg, elapsed)
+
+        self.emit('Shot "%s" saved in %.1fs' % (self.current, elapsed))
+        self.current = None
+
+    def record_files(self, name, media_path, blend_path):
+        # Sizes as saved, before any deferred compression.
+        shot = self.shots.get(name)
+        if shot is None:
+            return
+        for key, path in (('media_bytes', media_path), ('blend_bytes', blend_path)):
+            shot[key] = os.path.getsize(path) if os.path.exists(path) else None
+
+    def shot_stats(self):
+        return [{'shot': name, 'frames': shot['frames'],
+                 'render_time': None if shot['render_time'] is None
+                 else round(shot['render_time'], 3),
+                 'save_time': None if shot['save_time'] is None
+                 else round(shot['save_time'], 3),
+                 'fps': round(self.shot_fps(name), 3) if shot['render_time'] else None,
+                 'media_bytes': shot['media_bytes'],
+                 'blend_bytes': shot['blend_bytes']}
+                for name, shot in self.shots.items()]
+
+    def end(self):
+        if self.window_manager:
+            self.window_manager.progress_end()
+        self.emit("Extracted %d shots (%d frames) in %s: render %s (%.1f fps), save %s" %
+                  (self.saved_count, self.rendered_frames,
+                   format_duration(self.elapsed()),
+                   format_duration(self.render_time), self.average_fps(),
+                   format_duration(self.save_time)),
+                  status=False)
+
+    def moving_average(self, average, value):
+        if average is None:
+            return value
+        return self.SMOOTHING * value + (1.0 - self.SMOOTHING) * average
+
+    def shot_fps(self, name):
+        shot = self.shots[name]
+        if not shot['render_time']:
+            return 0.0
+        return shot['frames'] / shot['render_time']
+
+    def average_fps(self):
+        return self.rendered_frames / self.render_time if self.render_time else 0.0
+
+    def elapsed(self):
+        return time.time() - self.time_start
+
+    def eta(self):
+        # Remaining frames at the averaged render speed, plus remaining
+        # files at the averaged save time. None until one shot is done.
+        if self.frame_time_avg is None:
+            return None
+        remaining_saves = len(self.shots) - self.saved_count
+        return ((self.total_frames - self.rendered_frames) * self.frame_time_avg
+                + remaining_saves * (self.save_time_avg or 0.0))
+
+    def status_text(self):
+        eta = self.eta()
+        return "[%d/%d frames, %.1f fps, elapsed %s, ETA %s]" % (
+            self.rendered_frames, self.total_frames, self.average_fps(),
+            format_duration(self.elapsed()),
+            format_duration(eta) if eta is not None else "-")
+
+    def emit(self, message, status=True):
+        eta = self.eta()
+        if self.window_manager and status and eta is not None:
+            # The first save may raise the ETA, don't let the bar go back.
+            elapsed = self.elapsed()
+            self.percent_done = max(self.percent_done, 100.0 * elapsed / (elapsed + eta)
+                                    if elapsed + eta else 100.0)
+            self.window_manager.progress_update(self.percent_done)
+        if self.stream:
+            self.stream.write(message + (" " + self.status_text() if status else "") + "\n")
+            self.stream.flush()
+
+
+BELOW_NORMAL_PRIORITY_CLASS = 0x00004000  # Windows process creation flag
+
+COMPRESS_SCRIPT = '''
+import gzip, os, shutil, sys
+if hasattr(os, "nice"):
+    os.nice(10)
+path, temppath = sys.argv[1:3]
+with open(path, "rb") as src, gzip.open(temppath, "wb", 6) as dst:
+    shutil.copyfileobj(src, dst, 1 << 20)
+os.replace(temppath, path)
+'''
+
+
+class DeferredCompressor():
+    # Compresses saved .blend files in separate Python processes, so
+    # extraction can go on saving uncompressed files at full speed.
+    # Each file is written to a temporary file next to it and swapped
+    # in with an atomic rename once done. A summary is printed once
+    # finish() has been called and the last pending file is done.
+    # Rendering goes on meanwhile, so by default at most two processes
+    # run at once, leaving a core free, and at a lower priority.
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or max(1, min(2, (os.cpu_count() or 1) - 1))
+        self.executor = None
+        self.futures = {}
+        self.sizes = {}  # compressed size by file path
+        self.callbacks = []  # see when_done()
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.count = 0
+        self.failed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.compress_time = 0.0
+        self.time_start = None
+        self.finishing = False
+
+    def submit(self, filepath):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            if self.time_start is None:
+                self.time_start = time.time()
+            self.finishing = False
+            future = self.executor.submit(self.compress, filepath)
+            self.futures[filepath] = future
+        future.add_done_callback(lambda f: self.compress_done(filepath, f))
+        return future
+
+    def compress(self, filepath):
+        # The worker threads only wait on the child processes doing the
+        # actual (GIL-free) compression.
+        python = getattr(bpy.app, "binary_path_python", None) or sys.executable
+        temppath = filepath + ".gz.tmp"
+        size_before = os.path.getsize(filepath)
+        time_start = time.time()
+        returncode = subprocess.call(
+            [python, "-c", COMPRESS_SCRIPT, filepath, temppath],
+            creationflags=BELOW_NORMAL_PRIORITY_CLASS if sys.platform == "win32" else 0)
+        if returncode != 0:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+            raise RuntimeError('Compressing "%s" failed with code %d' %
+                               (filepath, returncode))
+        return size_before, os.path.getsize(filepath), time.time() - time_start
+
+    def compress_done(self, filepath, future):
+        with self.lock:
+            if self.futures.get(filepath) is future:
+                del self.futures[filepath]
+            if future.exception():
+                self.failed += 1
+                sys.stdout.write("%s\n" % future.exception())
+            else:
+                size_before, size_after, elapsed = future.result()
+                self.count += 1
+                self.bytes_before += size_before
+                self.bytes_after += size_after
+                self.compress_time += elapsed
+                self.sizes[filepath] = size_after
+            if self.finishing and not self.futures:
+                self.write_summary()
+            callbacks = []
+            if not self.futures:
+                callbacks, self.callbacks = self.callbacks, []
+                sizes = dict(self.sizes)
+        for callback in callbacks:
+            callback(sizes)
+
+    def finish(self):
+        # No more files to come for now, summarize once all are done.
+        with self.lock:
+            if self.time_start is None:
+                return
+            self.finishing = True
+            if not self.futures:
+                self.write_summary()
+
+    def when_done(self, callback):
+        # Call `callback` with the compressed sizes by file path once no
+        # file is left to compress: right away if none is pending, else
+        # from the worker thread finishing the last one.
+        with self.lock:
+            if self.futures:
+                self.callbacks.append(callback)
+                return
+            sizes = dict(self.sizes)
+        callback(sizes)
+
+    def write_summary(self):
+        sys.stdout.write(self.summary() + "\n")
+        sys.stdout.flush()
+        self.reset_stats()
+
+    def wait(self, filepath=None):
+        # Block until the given file, or all files, are compressed.
+        with self.lock:
+            futures = [self.futures[filepath]] if filepath in self.futures \
+                else [] if filepath else list(self.futures.values())
+        concurrent.futures.wait(futures)
+
+    def summary(self):
+        saved = self.bytes_before - self.bytes_after
+        return ("Compressed %d layout files in %s (%s of compression), "
+                "saved %.1f MB (%.0f%%)%s" %
+                (self.count, format_duration(time.time() - self.time_start),
+                 format_duration(self.compress_time), saved / 1048576.0,
+                 100.0 * saved / self.bytes_before if self.bytes_before else 0.0,
+                 ", %d failed" % self.failed if self.failed else ""))
+
+
+deferred_compressor = DeferredCompressor()
+
+
+BlendBlock = collections.namedtuple(
+    "BlendBlock", ["code", "size", "address", "sdna_index", "count", "offset"])
+BlendField = collections.namedtuple(
+    "BlendField", ["type", "offset", "is_pointer", "count"])
+
+
+class BlendFile():
+    # Minimal reader for the .blend file format, enough to pull a few
+    # struct fields out of a saved file without starting Blender. Only
+    # the block headers are scanned on opening, block data is read on
+    # request, so even very large files are cheap to open. Compressed
+    # files are decompressed once to a temporary file, as every seek
+    # back in a gzip stream decompresses it again from the start.
+    FIELD_FORMATS = {"char": "b", "uchar": "B", "short": "h", "ushort": "H",
+                     "int": "i", "long": "i", "ulong": "I", "float": "f",
+                     "double": "d", "int64_t": "q", "uint64_t": "Q"}
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            magic = f.read(2)
+        if magic == b"\x1f\x8b":
+            self.file = tempfile.TemporaryFile()
+            with gzip.open(filepath, "rb") as f:
+                shutil.copyfileobj(f, self.file, 1 << 20)
+            self.file.seek(0)
+        else:
+            self.file = open(filepath, "rb")
+
+        header = self.file.read(12)
+        if len(header) < 12 or header[:7] != b"BLENDER":
+            self.file.close()
+            raise ValueError('"%s" is not a .blend file' % filepath)
+        self.pointer_size = 8 if header[7:8] == b"-" else 4
+        self.endian = ">" if header[8:9] == b"V" else "<"
+        self.version = int(header[9:12])
+
+        self.blocks = []
+        self.structs = {}
+        self.read_blocks()
+        self.read_sdna()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def read_blocks(self):
+        fmt = self.endian + "4si" + ("Q" if self.pointer_size == 8 else "I") + "ii"
+        header_size = struct.calcsize(fmt)
+        while True:
+            header = self.file.read(header_size)
+            if len(header) < header_size:
+                raise ValueError('"%s" is truncated' % self.filepath)
+            code, size, address, sdna_index, count = struct.unpack(fmt, header)
+            code = code.rstrip(b"\0")
+            if code == b"ENDB":
+                break
+            self.blocks.append(BlendBlock(code, size, address, sdna_index,
+                                          count, self.file.tell()))
+            self.file.seek(size, 1)
+
+    def read_sdna(self):
+        dna = self.find_blocks(b"DNA1")
+        if not dna:
+            raise ValueError('"%s" has no SDNA' % self.filepath)
+        data = self.read_block(dna[0])
+        endian = self.endian
+
+        def read_strings(pos):
+            count = struct.unpack_from(endian + "i", data, pos)[0]
+            pos += 4
+            strings = []
+            for i in range(count):
+                end = data.index(b"\0", pos)
+                strings.append(data[pos:end].decode("ascii"))
+                pos = end + 1
+            return strings, (pos + 3) & ~3
+
+        names, pos = read_strings(8)  # skip "SDNA" and "NAME"
+        types, pos = read_strings(pos + 4)  # skip "TYPE"
+        pos += 4  # skip "TLEN"
+        lengths = struct.unpack_from(endian + "%dh" % len(types), data, pos)
+        pos = (pos + 2 * len(types) + 3) & ~3
+        pos += 4  # skip "STRC"
+        count = struct.unpack_from(endian + "i", data, pos)[0]
+        pos += 4
+
+        self.struct_names = []
+        for i in range(count):
+            type_index, field_count = struct.unpack_from(endian + "hh", data, pos)
+            pos += 4
+            fields = {}
+            offset = 0
+            for j in range(field_count):
+                field_type, field_name = struct.unpack_from(endian + "hh", data, pos)
+                pos += 4
+                name = names[field_name]
+                is_pointer = name.startswith("*") or name.startswith("(*")
+                count = 1
+                for dim in re.findall(r"\[(\d+)\]", name):
+                    count *= int(dim)
+                size = self.pointer_size if is_pointer else lengths[field_type]
+                fields[re.search(r"\w+", name).group()] = BlendField(
+                    types[field_type], offset, is_pointer, count)
+                offset += size * count
+            self.struct_names.append(types[type_index])
+            self.structs[types[type_index]] = (lengths[type_index], fields)
+
+    def find_blocks(self, code):
+        return [block for block in self.blocks if block.code == code]
+
+    def read_block(self, block):
+        self.file.seek(block.offset)
+        return self.file.read(block.size)
+
+    def get(self, data, struct_name, path, index=0):
+        # Read a (possibly nested, dot-separated) field of the struct
+        # stored at position `index` of a block's data.
+        offset = index * self.structs[struct_name][0]
+        for name in path.split("."):
+            field = self.structs[struct_name][1][name]
+            offset += field.offset
+            struct_name = field.type
+
+        if field.is_pointer:
+            fmt = "Q" if self.pointer_size == 8 else "I"
+        elif field.type == "char" and field.count > 1:
+            value = data[offset:offset + field.count]
+            return value.split(b"\0", 1)[0].decode("utf-8", "replace")
+        else:
+            fmt = self.FIELD_FORMATS[field.type]
+        values = struct.unpack_from(
+            self.endian + "%d%s" % (field.count, fmt), data, offset)
+        return values if field.count > 1 else values[0]
+
+
+def get_blend_frame_range(filepath, scene_name=None):
+    # Frame range of the named scene (or the first one) in a .blend file.
+    with BlendFile(filepath) as blend:
+        for block in blend.find_blocks(b"SC"):
+            data = blend.read_block(block)
+            if scene_name is not None \
+                    and blend.get(data, "Scene", "id.name")[2:] != scene_name:
+                continue
+            return (blend.get(data, "Scene", "r.sfra"),
+                    blend.get(data, "Scene", "r.efra"))
+    return None
+
+
+def get_blend_objects(filepath):
+    # Objects of all scenes in a .blend file, without loading it: name,
+    # type, layers, world matrix (rows) and local bounds, where the
+    # object data has a texture space to take them from.
+    object_infos = collections.OrderedDict()
+    with BlendFile(filepath) as blend:
+        blocks = dict((block.address, block) for block in blend.blocks)
+
+        object_blocks = []
+        if "base" in blend.structs["Scene"][1]:
+            for block in blend.find_blocks(b"SC"):
+                address = blend.get(blend.read_block(block), "Scene", "base.first")
+                visited = set()
+                while address in blocks and address not in visited:
+                    visited.add(address)
+                    base = blend.read_block(blocks[address])
+                    object_address = blend.get(base, "Base", "object")
+                    if object_address in blocks:
+                        object_blocks.append(blocks[object_address])
+                    address = blend.get(base, "Base", "next")
+        else:  # scenes without bases, take every object
+            object_blocks = blend.find_blocks(b"OB")
+
+        for block in object_blocks:
+            data = blend.read_block(block)
+            name = blend.get(data, "Object", "id.name")[2:]
+            if name in object_infos:
+                continue
+
+            bounds = None
+            data_block = blocks.get(blend.get(data, "Object", "data"))
+            if data_block:
+                struct_name = blend.struct_names[data_block.sdna_index]
+                fields = blend.structs[struct_name][1]
+                if "loc" in fields and "size" in fields:
+                    ob_data = blend.read_block(data_block)
+                    loc = blend.get(ob_data, struct_name, "loc")
+                    size = blend.get(ob_data, struct_name, "size")
+                    if any(size):
+                        bounds = (tuple(l - s for l, s in zip(loc, size)),
+                                  tuple(l + s for l, s in zip(loc, size)))
+
+            obmat = blend.get(data, "Object", "obmat")
+            object_infos[name] = {
+                'name': name,
+                'type': BLEND_OBJECT_TYPES.get(blend.get(data, "Object", "type"), 'EMPTY'),
+                'layers': blend.get(data, "Object", "lay"),
+                'matrix': [obmat[i:i + 4] for i in range(0, 16, 4)],
+                'bounds': bounds}
+
+    return list(object_infos.values())
+
+
+def get_wav_sample_count(filepath):
+    # Returns (sample count, sample rate) read from a RIFF/WAVE header.
+    with open(filepath, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise ValueError('"%s" is not a WAV file' % filepath)
+
+        rate = block_align = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                rate, = struct.unpack_from("<I", fmt, 4)
+                block_align, = struct.unpack_from("<H", fmt, 12)
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b"data":
+                if not rate or not block_align:
+                    break
+                # An interrupted mixdown leaves a declared size larger
+                # than what is actually in the file.
+                available = os.fstat(f.fileno()).st_size - f.tell()
+                return min(chunk_size, available) // block_align, rate
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+    raise ValueError('"%s" has no audio data' % filepath)
+
+
+def iter_movie_atoms(f, start, end):
+    # Yields (type, payload start, atom end) of QuickTime atoms in range.
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, atom_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            break
+        yield atom_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def find_movie_atom(f, start, end, path):
+    for atom_type in path:
+        for child_type, child_start, child_end in iter_movie_atoms(f, start, end):
+            if child_type == atom_type:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def get_movie_frame_count(filepath):
+    # Counts video samples in a QuickTime file's sample-to-time table.
+    with open(filepath, "rb") as f:
+        moov = find_movie_atom(f, 0, os.fstat(f.fileno()).st_size, [b"moov"])
+        if not moov:
+            raise ValueError('"%s" has no movie header' % filepath)
+
+        for atom_type, start, end in list(iter_movie_atoms(f, *moov)):
+            if atom_type != b"trak":
+                continue
+            hdlr = find_movie_atom(f, start, end, [b"mdia", b"hdlr"])
+            if not hdlr:
+                continue
+            f.seek(hdlr[0] + 8)
+            if f.read(4) != b"vide":
+                continue
+            stts = find_movie_atom(f, start, end,
+                                   [b"mdia", b"minf", b"stbl", b"stts"])
+            if not stts:
+                continue
+            f.seek(stts[0] + 4)
+            entry_count, = struct.unpack(">I", f.read(4))
+            entries = struct.unpack(">%dI" % (2 * entry_count),
+                                    f.read(8 * entry_count))
+            return sum(entries[0::2])
+
+    raise ValueError('"%s" has no video track' % filepath)
+
+
+def verify_shot_files(marker_infos, render_basepath, fps, frame_start,
+                      scene_name=None, is_render_video=False, max_workers=None):
+    # Check every shot's sound/video and layout file against the shot
+    # list. The files are independent, so they're read in a thread
+    # pool. Returns a list of (shot name, problem, message) tuples,
+    # where problem is one of 'MISSING', 'TRUNCATED' or 'STALE'.
+    media_ext = '.mov' if is_render_video else '.wav'
+    media_label = 'video' if is_render_video else 'sound'
+
+    def check_shot(mi):
+        problems = []
+        frames = mi['end'] - mi['start'] + 1
+
+        mediapath = os.path.join(render_basepath, 'sounds', mi['name'] + media_ext)
+        if not os.path.exists(mediapath):
+            problems.append(('MISSING', 'no %s file' % media_label))
+        else:
+            try:
+                if is_render_video:
+                    length = get_movie_frame_count(mediapath)
+                else:
+                    samples, rate = get_wav_sample_count(mediapath)
+                    length = samples * fps / rate
+            except (OSError, ValueError, struct.error) as e:
+                problems.append(('TRUNCATED', 'unreadable %s file (%s)'
+                                 % (media_label, e)))
+            else:
+                if length < frames - 0.5:
+                    problems.append(('TRUNCATED', '%s file is %.1f of %d frames'
+                                     % (media_label, length, frames)))
+                elif length > frames + 0.5:
+                    problems.append(('STALE', '%s file is %.1f frames, expected %d'
+                                     % (media_label, length, frames)))
+
+        layoutpath = os.path.join(render_basepath, 'layouts', mi['name'] + '.blend')
+        expected = (frame_start, frame_start + mi['end'] - (mi['start'] + 1))
+        if not os.path.exists(layoutpath):
+            problems.append(('MISSING', 'no layout file'))
+            return problems
+        try:
+            frame_range = get_blend_frame_range(layoutpath, scene_name)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            problems.append(('TRUNCATED', 'unreadable layout file (%s)' % e))
+            return problems
+        if frame_range != expected:
+            problems.append(('STALE', 'layout frame range is %s, expected %d-%d'
+                             % ('%d-%d' % frame_range if frame_range else 'unknown',
+                                expected[0], expected[1])))
+        elif os.path.exists(mediapath) \
+                and os.path.getmtime(layoutpath) < os.path.getmtime(mediapath):
+            problems.append(('STALE', 'layout file is older than its %s file'
+                             % media_label))
+        return problems
+
+    if not max_workers:
+        max_workers = (os.cpu_count() or 1) * 4
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(check_shot, marker_infos))
+
+    return [(mi['name'], problem, message)
+            for mi, problems in zip(marker_infos, results)
+            for problem, message in problems]
+
+
+def extract_headless(selected_only=False, reload_file=True):
+    # Extract the open animatic in background mode. When the memory
+    # ceiling is reached, the operator leaves a checkpoint and reloads
+    # the file; extraction then resumes from that checkpoint until all
+    # shots are done. Returns a summary dictionary.
+    result = {'status': 'CANCELLED', 'shots': 0, 'frames': 0}
+    resume = False
+    while True:
+        ExtractShotfiles_Base.last_progress = None
+        status = bpy.ops.sequencer.oha_extract_shot_files(
+            selected_only=selected_only, reload_file=reload_file, resume=resume)
+        result['status'] = status.pop() if status else 'CANCELLED'
+        progress = ExtractShotfiles_Base.last_progress
+        if progress:
+            result['shots'] += progress.saved_count
+            result['frames'] += progress.rendered_frames
+        if result['status'] != 'FINISHED' or not ExtractShotfiles_Base.last_checkpoint:
+            return result
+        resume = True
+
+
+@persistent
+def resume_extraction_handler(dummy):
+    # After a reload caused by the memory ceiling, resume extraction
+    # once the file is fully loaded. Background runs are resumed by
+    # extract_headless() instead.
+    checkpoint_path = ExtractShotfiles_Base.last_checkpoint
+    if bpy.app.background or not checkpoint_path:
+        return
+    try:
+        with open(checkpoint_path) as f:
+            blendpath = json.load(f)['file']
+    except (OSError, ValueError, KeyError):
+        return
+    if blendpath == bpy.path.abspath(bpy.data.filepath) \
+            and resume_extraction not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(resume_extraction)
+
+
+def resume_extraction(scene):
+    # One-shot scene update handler: the modal operator needs a window
+    # and an area, which load handlers don't have.
+    bpy.app.handlers.scene_update_post.remove(resume_extraction)
+
+    window = bpy.context.window_manager.windows[0]
+    areas = sorted(window.screen.areas, key=lambda a: a.type != 'SEQUENCE_EDITOR')
+    regions = [r for r in areas[0].regions if r.type == 'WINDOW']
+    override = {'window': window, 'screen': window.screen,
+                'area': areas[0], 'region': regions[0]}
+    bpy.ops.sequencer.oha_extract_shot_files(override, 'INVOKE_DEFAULT', resume=True)
+
+
+BATCH_RESULT_PREFIX = "OHA_BATCH_RESULT "
+
+
+def batch_worker():
+    # Main loop of a headless Blender started by batch_extract(): read
+    # animatic paths from stdin, one per line, and extract each in turn
+    # within the same process. Result of each file is written to stdout
+    # as a prefixed JSON line. An empty line or end of input stops it.
+    for line in iter(sys.stdin.readline, ''):
+        blendpath = line.strip()
+        if not blendpath:
+            break
+
+        result = {'file': blendpath, 'status': 'ERROR', 'message': '',
+                  'shots': 0, 'frames': 0, 'time': 0.0}
+        time_start = time.time()
+        try:
+            bpy.ops.wm.open_mainfile(filepath=blendpath)
+            result.update(extract_headless(reload_file=False))
+        except Exception as e:
+            result['message'] = str(e).strip()
+        result['time'] = time.time() - time_start
+
+        # Reloading doesn't give back everything, a fresh process does.
+        prefs = bpy.context.user_preferences.addons[__name__].preferences
+        result['restart'] = memory_exceeded(prefs.memory_limit)
+
+        sys.stdout.write(BATCH_RESULT_PREFIX + json.dumps(result) + "\n")
+        sys.stdout.flush()
+        if result['restart']:
+            break
+
+    deferred_compressor.wait()
+
+
+def batch_extract(paths, workers=2, blender=None, stream=sys.stdout):
+    # Extract every animatic in `paths` (files, or directories searched
+    # for .blend files) using a pool of long-lived headless Blender
+    # processes, so startup cost is paid once per worker instead of
+    # once per file. Returns a list of per-file result dictionaries.
+    blendpaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            blendpaths.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith('.blend')))
+        else:
+            blendpaths.append(path)
+    blendpaths = list(collections.OrderedDict.fromkeys(
+        os.path.abspath(path) for path in blendpaths))
+
+    pending = queue.Queue()
+    for blendpath in blendpaths:
+        pending.put(blendpath)
+    results = {}
+    stream_lock = threading.Lock()
+    command = [blender or bpy.app.binary_path, '-b', '--addons', __name__,
+               '--python-expr', 'import %s; %s.batch_worker()' % (__name__, __name__)]
+
+    def write(message):
+        with stream_lock:
+            stream.write(message + "\n")
+            stream.flush()
+
+    def error_result(blendpath, message):
+        return {'file': blendpath, 'status': 'ERROR', 'shots': 0,
+                'frames': 0, 'time': 0.0, 'message': message}
+
+    def run_worker(worker_id):
+        process = None
+        while True:
+            try:
+                blendpath = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if process is None:
+                    process = subprocess.Popen(
+                        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT, universal_newlines=True)
+
+                write('[worker %d] Extracting "%s"' % (worker_id, blendpath))
+                process.stdin.write(blendpath + "\n")
+                process.stdin.flush()
+                for line in iter(process.stdout.readline, ''):
+                    if line.startswith(BATCH_RESULT_PREFIX):
+                        results[blendpath] = json.loads(line[len(BATCH_RESULT_PREFIX):])
+                        if results[blendpath].get('restart'):
+                            write('[worker %d] Memory ceiling reached, restarting' % worker_id)
+                            process.stdin.close()
+                            process.wait()
+                            process = None
+                        break
+                    write('[worker %d] %s' % (worker_id, line.rstrip()))
+                else:
+                    # Blender died on this file, start afresh for the next.
+                    results[blendpath] = error_result(
+                        blendpath, 'worker exited with code %s' % process.wait())
+                    process = None
+            except Exception as e:
+                # Couldn't start or talk to Blender, don't let the thread
+                # die with the file unaccounted for.
+                results[blendpath] = error_result(blendpath, str(e) or repr(e))
+                write('[worker %d] Failed on "%s": %s' %
+                      (worker_id, blendpath, results[blendpath]['message']))
+                if process:
+                    process.kill()
+                    process.wait()
+                process = None
+
+        if process:
+            process.stdin.close()
+            process.wait()
+
+    threads = [threading.Thread(target=run_worker, args=(i + 1,))
+               for i in range(max(1, min(workers, len(blendpaths))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = [results.get(blendpath) or error_result(blendpath, 'not extracted')
+               for blendpath in blendpaths]
+    write("Batch extraction summary:")
+    for result in results:
+        write('  %s: %s, %d shots, %d frames, %s%s' %
+              (os.path.basename(result['file']), result['status'],
+               result['shots'], result['frames'], format_duration(result['time']),
+               ' (%s)' % result['message'] if result['message'] else ''))
+    write("%d of %d files extracted." %
+          (len([r for r in results if r['status'] == 'FINISHED']), len(results)))
+
+    return results
+
+
+def batch_main():
+    # Command line entry point, arguments are read after "--":
+    # blender -b --addons layout_tools --python-expr
+    #     "import layout_tools; layout_tools.batch_main()" -- FILE_OR_DIR...
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(
+        prog="layout_tools batch",
+        description="Extract layout files from many animatic files.")
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help="animatic .blend file, or directory of them")
+    parser.add_argument("-w", "--workers", type=int, default=2,
+                        help="number of Blender processes to run at once")
+    args = parser.parse_args(argv)
+
+    batch_extract(args.paths, workers=args.workers)
+
+
+def extract_changed_shots(blendpath, stream=sys.stdout):
+    # Reload the animatic and extract only the shots whose signature
+    # differs from the one recorded by the last extraction, or whose
+    # layout file is missing. Returns the names of extracted shots.
+    bpy.ops.wm.open_mainfile(filepath=blendpath)
+    context = bpy.context
+    scene = context.scene
+    prefs = context.user_preferences.addons[__name__].preferences
+
+    marker_infos = get_marker_infos(scene)
+    adjust_duration_to_effects(context, marker_infos)
+    render_basepath = get_layout_basepath(blendpath, prefs.layout_path)
+    manifest = read_extract_manifest(render_basepath)
+
+    changed = set(
+        mi['name'] for mi in marker_infos
+        if manifest.get(mi['name']) != get_shot_signature(scene, mi, prefs.is_render_video)
+        or not os.path.exists(os.path.join(render_basepath, 'layouts',
+                                           mi['name'] + '.blend')))
+    if not changed:
+        stream.write("No shot changed in %s\n" % blendpath)
+        return []
+
+    stream.write("Extracting changed shots: %s\n" % ", ".join(sorted(changed)))
+    for marker in scene.timeline_markers:
+        marker.select = marker.name in changed
+    extract_headless(selected_only=True, reload_file=False)
+
+    return sorted(changed)
+
+
+def watch_animatic(blendpath, interval=2.0, debounce=10.0, stream=sys.stdout):
+    # Poll the animatic's modification time, and once it has stayed
+    # unchanged for `debounce` seconds re-extract the changed shots. A
+    # burst of saves thus triggers a single run. Runs until interrupted.
+    blendpath = os.path.abspath(blendpath)
+    seen_mtime = None
+    changed_at = time.time() - debounce  # catch up on startup
+    pending = True
+
+    stream.write('Watching "%s"\n' % blendpath)
+    stream.flush()
+    while True:
+        try:
+            mtime = os.path.getmtime(blendpath)
+        except OSError:  # in the middle of being replaced
+            mtime = seen_mtime
+        if mtime != seen_mtime:
+            seen_mtime = mtime
+            changed_at = time.time()
+            pending = True
+
+        if pending and time.time() - changed_at >= debounce:
+            pending = False
+            try:
+                extract_changed_shots(blendpath, stream)
+            except Exception as e:
+                stream.write("Extraction failed: %s\n" % e)
+            stream.flush()
+
+        time.sleep(interval)
+
+
+def watch_main():
+    # Command line entry point, arguments are read after "--":
+    # blender -b --addons layout_tools --python-expr
+    #     "import layout_tools; layout_tools.watch_main()" -- ANIMATIC
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(
+        prog="layout_tools watch",
+        description="Re-extract changed shots whenever the animatic is saved.")
+    parser.add_argument("blendpath", metavar="ANIMATIC",
+                        help="animatic .blend file to watch")
+    parser.add_argument("-i", "--interval", type=float, default=2.0,
+                        help="seconds between checks of the file")
+    parser.add_argument("-d", "--debounce", type=float, default=10.0,
+                        help="seconds the file must stay unchanged before extracting")
+    args = parser.parse_args(argv)
+
+    try:
+        watch_animatic(args.blendpath, args.interval, args.debounce)
+    except KeyboardInterrupt:
+        pass
+
+
 # =========================== addon interface ==========================
 
 def sequencer_headerbutton(self, context):
@@ -834,6 +2330,8 @@ def sequencer_headerbutton(self, context):
     row = layout.row(align=True)
     row.operator('sequencer.oha_extract_shot_files', icon='ALIGN',
                  text='Extract')
+    row.operator('sequencer.oha_verify_shot_files', icon='FILE_TICK',
+                 text='Verify')
 
 
 def menu_func_import(self, context):
@@ -850,6 +2348,8 @@ def register():
 
     bpy.types.SEQUENCER_HT_header.append(draw_func)
 
+    bpy.app.handlers.load_post.append(resume_extraction_handler)
+
 
 def unregister():
     bpy.utils.unregister_module(__name__)
@@ -860,6 +2360,8 @@ def unregister():
 
     bpy.types.SEQUENCER_HT_header.remove(draw_func)
 
+    bpy.app.handlers.load_post.remove(resume_extraction_handler)
+
 
 if __name__ == "__main__":
     register()